@@ -1,21 +1,39 @@
 import asyncio
+import functools
+import hashlib
 import json
+import logging
+import queue
 import re
-from contextlib import AsyncExitStack
-from typing import Any, Dict, List, Optional
+import time
+from logging.handlers import QueueHandler, QueueListener
+from collections import Counter, OrderedDict
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import Any, Dict, Final, List, Optional
 from pydantic import BaseModel
 
+import jinja2
+import orjson
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
 
-from agent_framework import AgentRunEvent, WorkflowBuilder, WorkflowOutputEvent, Executor, handler
+from agent_framework import AgentExecutorResponse, AgentRunEvent, AgentRunUpdateEvent, WorkflowBuilder, WorkflowOutputEvent, Executor, handler
 from agent_framework import AIFunction, WorkflowContext
 from agent_framework.openai import OpenAIChatClient
 
 from fastmcp import Client as FastMCPClient
+import sqlglot
+from sqlglot import exp as sqlglot_exp
 import os
+import httpx
 from dotenv import load_dotenv
 
+try:
+    from Backend.semantic_cache import SemanticCache
+except ImportError:
+    from semantic_cache import SemanticCache
+
 load_dotenv()
 
 # ============== Pydantic Models =============
@@ -27,29 +45,12 @@ class QueryResponse(BaseModel):
     response: str
 
 # ============== Prompts ==============
-DB_SELECTOR_PROMPT = """
-You are a Database Selection Agent. Your job is to:
-1. List all available databases using the list_databases tool
-2. Get the schema for each database using the get_schema tool
-3. Analyze the user's question and select the most relevant database
-4. Return the selected database name and its schema
-
-When you receive a user question:
-- Call list_databases to see available databases
-- Call get_schema for each database
-- Match keywords from the question with table/column names in schemas
-- Select the best matching database
-- Return ONLY a JSON object in this format:
-{
-  "selected_db": "database_name",
-  "schema": "CREATE TABLE statements...",
-  "reasoning": "Why this database was selected"
-}
-
-IMPORTANT: Always return a valid JSON object. Do not include any markdown, code fences, or explanations outside the JSON.
-"""
-
-Prompt_nlp_sql = """
+# Prompt-prefix caching invariant: these prompts must stay byte-identical
+# across requests, with all per-request content (question, schemas, results)
+# appended after them in the user message — never interpolated into the
+# middle. The provider's implicit prompt caching then reuses the static
+# prefix KV on every request.
+Prompt_nlp_sql: Final[str] = """
 You are an **NLP-to-SQL generation** agent. Your job is to convert a natural-language question into a correct, read-only SQL query (SQLite dialect).
 
 Rules:
@@ -58,12 +59,12 @@ Rules:
 - Do NOT include explanations or commentary
 - Use SELECT only
 - Use LIMIT 50 if no limit is specified
-- Use table and column names exactly as in the schema snippet provided
+- Pick the single most relevant database from the schema bundle
+- Use table and column names exactly as in the schema bundle provided
 
 Input:
 - A user question
-- A schema snippet (CREATE TABLE statements)
-- Previous selected_db from Database Selector
+- A schema bundle listing every available database and its CREATE TABLE statements
 
 Output Format MUST be JSON:
 {"selected_db": "database_name", "query": "SELECT ... LIMIT 50"}
@@ -71,7 +72,7 @@ Output Format MUST be JSON:
 IMPORTANT: Return ONLY valid JSON, no markdown or extra text.
 """
 
-SQL_EXECUTOR_PROMPT = """
+SQL_EXECUTOR_PROMPT: Final[str] = """
 You are a SQL Execution Agent. Your job is to:
 1. Receive a SQL query and database name
 2. Execute the query using the run_sql tool
@@ -91,7 +92,7 @@ When executing:
 Output MUST be valid JSON only, no markdown or extra text.
 """
 
-Response_Prompt = """
+Response_Prompt: Final[str] = """
 You are a response generator. Your ONLY job is to format query results EXACTLY as they are returned.
 
 CRITICAL RULES - DO NOT BREAK THESE:
@@ -124,7 +125,7 @@ DO NOT:
 Return ONLY the formatted results, no JSON or markdown code fences.
 """
 
-Prompt_validator = """
+Prompt_validator: Final[str] = """
 You are a **SQL Validation** agent. Validate the SQL query to ensure it is safe and read-only.
 
 Rules:
@@ -145,17 +146,71 @@ Output MUST be valid JSON:
 IMPORTANT: Return ONLY valid JSON, no markdown or extra text.
 """
 
+Final_Agent_Prompt: Final[str] = """
+You are the final agent in the workflow. Your role is to process the output from the previous agent and present it as a clear and concise final result for the user.
+
+Guidelines:
+1. If the previous agent's output contains results, summarize the key information in a user-friendly format.
+2. If no results are found, explicitly state that no matching records were retrieved.
+3. Ensure the output is well-structured, easy to understand, and free of unnecessary details.
+
+Example:
+Input:
+{
+"database_used": "orders",
+"sql_executed": "SELECT count(T1.`Order ID`) FROM order_table AS T1 INNER JOIN orders_table AS T2 ON T1.`Customer Name` = T2.`Customer Name` WHERE T2.`Customer Gender` = 'Female' LIMIT 50",
+"num_rows": 1,
+"results": [
+    {
+    "count(T1.`Order ID`)": 27
+    }
+],
+"status": "success"
+}
+
+Output:
+"The total number of orders placed by female customers is 27."
+
+If no results are found:
+"No matching records were found based on the query."
+"""
+
 # ============== Constants ==============
 MAX_LIMIT = 1000
 DEFAULT_USER_LIMIT = 50
+FINAL_AGENT_NAME = "final-Agent"
+# Marks replies produced by the error path; anything carrying it must never
+# enter the response caches
+ERROR_REPLY_PREFIX: Final[str] = "The query could not be executed:"
 
 # ============== FastAPI App ==============
-app = FastAPI(title="Customer Support MAF Backend")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Open the MCP connection and build the workflows concurrently, then
+    # tear both down on shutdown
+    await asyncio.gather(_open_mcp(), initialize_workflow())
+    yield
+    await sql_batcher.stop()
+    if mcp:
+        await mcp.__aexit__(None, None, None)
+
+app = FastAPI(
+    title="Customer Support MAF Backend",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
+)
 
-# Enable CORS
+# Enable CORS. An explicit origin list (comma-separated CORS_ORIGINS env
+# var) lets Starlette fast-path the origin check; the previous "*" with
+# allow_credentials=True was silently rejected by Starlette anyway.
+CORS_ORIGINS = [
+    origin.strip()
+    for origin in os.getenv("CORS_ORIGINS", "http://localhost:8501").split(",")
+    if origin.strip()
+]
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
+    allow_origins=CORS_ORIGINS,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
@@ -172,64 +227,651 @@ client_open = OpenAIChatClient(
 workflow = None
 mcp = None
 
+# Semantic cache: answers repeated/paraphrased questions without re-running the workflow
+semantic_cache = SemanticCache()
+SEMANTIC_CACHE_THRESHOLD = 0.87
+
+# Exact-match cache: L1 tier in front of the semantic cache, keyed by a hash
+# of the normalized question. Hits cost one hash + one dict lookup.
+EXACT_CACHE_MAX_ENTRIES = 4096
+_exact_cache: OrderedDict[str, str] = OrderedDict()
+_exact_cache_lock = asyncio.Lock()
+
+def normalize_q(q: str) -> str:
+    """Normalize a question for cache keying: lowercase, collapse whitespace,
+    drop trailing punctuation. The raw question is still what the LLM sees."""
+    return " ".join(q.lower().strip().rstrip("?.!").split())
+
+def _exact_cache_key(question: str) -> str:
+    return hashlib.sha256(normalize_q(question).encode()).hexdigest()
+
+# Per-event debug logging is opt-in: stringifying every agent message on the
+# hot path is measurable overhead.
+DEBUG_EVENTS = os.getenv("DEBUG_EVENTS", "").lower() in ("1", "true", "yes")
+
+# Queued logging: records are enqueued in-memory and a listener thread does
+# the actual stream I/O, so logging never blocks the event loop.
+logger = logging.getLogger(__name__)
+_log_queue: queue.SimpleQueue = queue.SimpleQueue()
+_log_listener = QueueListener(_log_queue, logging.StreamHandler())
+_log_listener.start()
+logger.addHandler(QueueHandler(_log_queue))
+logger.setLevel(logging.DEBUG if DEBUG_EVENTS else logging.INFO)
+
+def _is_cacheable_reply(text: str) -> bool:
+    """Only successful, non-empty replies may enter the response caches.
+
+    A transient failure cached for up to 7 days would be served verbatim to
+    this question — and, through the semantic tier, to paraphrases of it.
+    """
+    return bool(text) and not text.startswith(ERROR_REPLY_PREFIX)
+
+def _last_agent_text(events: Any) -> str:
+    """Fallback answer extraction when the workflow yielded no outputs."""
+    text = ""
+    for event in events:
+        if isinstance(event, AgentRunEvent) and getattr(event.data, "text", None):
+            text = event.data.text
+    return text
+
+# Back-pressure: bound in-flight workflows so a request burst cannot fan out
+# into unbounded concurrent LLM calls; beyond the queue threshold we shed
+# load with 429 instead of queuing indefinitely.
+MAX_CONCURRENT_WORKFLOWS = int(os.getenv("MAX_CONCURRENT_WORKFLOWS", "16"))
+MAX_WORKFLOW_QUEUE_DEPTH = int(os.getenv("MAX_WORKFLOW_QUEUE_DEPTH", "32"))
+_workflow_sem = asyncio.Semaphore(MAX_CONCURRENT_WORKFLOWS)
+_workflow_waiters = 0
+
+async def _acquire_workflow_slot() -> None:
+    """Wait for a workflow slot, or raise 429 when the queue is saturated."""
+    global _workflow_waiters
+    if _workflow_sem.locked() and _workflow_waiters >= MAX_WORKFLOW_QUEUE_DEPTH:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many queries in flight; please retry shortly",
+            headers={"Retry-After": "5"},
+        )
+    _workflow_waiters += 1
+    try:
+        await _workflow_sem.acquire()
+    finally:
+        _workflow_waiters -= 1
+
+# Schema/db-list cache: databases and schemas rarely change, so MCP results
+# are cached in-process with a TTL instead of round-tripping on every query.
+SCHEMA_CACHE_TTL = 300  # seconds
+_dblist_cache: Optional[tuple[float, Any]] = None
+_schema_cache: Dict[str, tuple[float, Any]] = {}
+_bundle_cache: Optional[tuple[float, str]] = None
+
+def _invalidate_mcp_caches() -> None:
+    global _dblist_cache, _bundle_cache
+    _dblist_cache = None
+    _bundle_cache = None
+    _schema_cache.clear()
+
+# Provider-side prompt cache handles: each static prompt is registered once
+# with Gemini's context-caching API and referenced by handle afterwards, so
+# the prompt text is not re-sent (or re-processed) on every request.
+# Opt-in: handles are baked into agents for the process lifetime, and the
+# extra_body pass-through has not been verified against the pinned
+# agent-framework build, so the feature stays off until explicitly enabled.
+GEMINI_PROMPT_CACHE_ENABLED = os.getenv("GEMINI_PROMPT_CACHE", "").lower() in ("1", "true", "yes")
+GEMINI_CACHE_TTL = "3600s"
+GEMINI_CACHE_REFRESH_INTERVAL = 1800  # seconds; re-up well before the TTL lapses
+_prompt_cache_ids: Dict[str, str] = {}
+_prompt_cache_refresh_task: Optional[asyncio.Task] = None
+
+async def _register_prompt_caches() -> None:
+    """Register the static agent prompts as Gemini cachedContents.
+
+    Best-effort: if registration fails (no API key, prompt below the
+    provider's minimum cacheable size, endpoint unavailable), the agents
+    simply keep sending the full prompt text.
+    """
+    api_key = os.environ.get("GOOGLE_API_KEY")
+    if not GEMINI_PROMPT_CACHE_ENABLED or not api_key:
+        return
+    prompts = {
+        "sql_generator": Prompt_nlp_sql,
+        "validator": Prompt_validator,
+        "sql_executor": SQL_EXECUTOR_PROMPT,
+        "final": Final_Agent_Prompt,
+    }
+    async with httpx.AsyncClient(timeout=10) as client:
+        for name, prompt in prompts.items():
+            try:
+                resp = await client.post(
+                    "https://generativelanguage.googleapis.com/v1beta/cachedContents",
+                    params={"key": api_key},
+                    json={
+                        "model": "models/gemini-2.5-flash",
+                        "systemInstruction": {"parts": [{"text": prompt}]},
+                        "ttl": GEMINI_CACHE_TTL,
+                    },
+                )
+                if resp.status_code == 200 and resp.json().get("name"):
+                    _prompt_cache_ids[name] = resp.json()["name"]
+            except httpx.HTTPError:
+                continue
+
+async def _refresh_prompt_caches() -> None:
+    """Keep registered cachedContents alive by re-upping their TTL.
+
+    Handles are referenced by agents for the process lifetime, so letting
+    one expire would fail every later call that carries it. A handle whose
+    refresh fails is dropped immediately rather than left to go stale.
+    """
+    api_key = os.environ.get("GOOGLE_API_KEY")
+    while _prompt_cache_ids:
+        await asyncio.sleep(GEMINI_CACHE_REFRESH_INTERVAL)
+        async with httpx.AsyncClient(timeout=10) as client:
+            for name, handle in list(_prompt_cache_ids.items()):
+                try:
+                    resp = await client.patch(
+                        f"https://generativelanguage.googleapis.com/v1beta/{handle}",
+                        params={"key": api_key},
+                        json={"ttl": GEMINI_CACHE_TTL},
+                    )
+                    if resp.status_code != 200:
+                        _prompt_cache_ids.pop(name, None)
+                except httpx.HTTPError:
+                    _prompt_cache_ids.pop(name, None)
+
+def _cached_prompt_kwargs(name: str) -> Dict[str, Any]:
+    """Agent kwargs attaching a registered cache handle, if one exists."""
+    handle = _prompt_cache_ids.get(name)
+    if not handle:
+        return {}
+    return {"extra_body": {"cached_content": handle}}
+
 # ============== Helper Functions ==============
+# Use RE2's linear-time DFA engine on the SQL validation path when available;
+# it caps worst-case matching at O(n) on user-influenced SQL strings.
+try:
+    import re2 as _sql_re
+except ImportError:
+    _sql_re = re
+
+_LIMIT_RE = _sql_re.compile(r"\blimit\s+(\d+)", _sql_re.IGNORECASE)
+_LIMIT_SUB_RE = _sql_re.compile(r"\blimit\s+\d+", _sql_re.IGNORECASE)
+_FORBIDDEN_RE = _sql_re.compile(
+    r"\b(INSERT|UPDATE|DELETE|DROP|ALTER|CREATE|TRUNCATE|MERGE|REPLACE|EXEC|GRANT|REVOKE|CALL)\b",
+    _sql_re.IGNORECASE,
+)
+
+# Fraud/security reports never need a database lookup: they get a canned
+# escalation answer, so routing them through the workflow (or even the
+# embedding cache) would burn an LLM roundtrip to produce boilerplate.
+FRAUD_KEYWORDS: Final[frozenset] = frozenset({
+    "fraud", "scam", "phishing", "stolen card", "unauthorized", "unauthorised",
+})
+_FRAUD_RE = _sql_re.compile(
+    r"\b(" + "|".join(sorted(FRAUD_KEYWORDS)) + r")\b",
+    _sql_re.IGNORECASE,
+)
+
+FRAUD_ESCALATION_RESPONSE: Final[str] = (
+    "This looks like a fraud or account-security concern. For your protection, "
+    "this assistant does not handle fraud reports: please contact our fraud "
+    "response team immediately via the security center in your account or the "
+    "phone number on the back of your card. If a card may be compromised, "
+    "freeze it from your account settings right away."
+)
+
+def _quick_route(question: str) -> Optional[str]:
+    """Keyword pre-router: return a canned response for questions that must
+    not reach the workflow, or None to proceed normally. One compiled regex
+    scan — no lowercased copy of the question, no LLM call."""
+    if _FRAUD_RE.search(question):
+        return FRAUD_ESCALATION_RESPONSE
+    return None
+
+def is_forbidden_sql(sql: str) -> bool:
+    """Fast hard-reject check for write/DDL keywords, so obviously unsafe
+    SQL can be bounced without an LLM validation roundtrip."""
+    return bool(_FORBIDDEN_RE.search(sql))
+
+def validate_sql_local(sql: str, schema: str) -> Dict[str, Any]:
+    """Deterministic SQL validation via sqlglot, mirroring the Validator agent's rules.
+
+    Returns {"status": "approved", "approved_sql": ...},
+            {"status": "rejected", "reason": ...}, or
+            {"status": "ambiguous", "reason": ...} when the query cannot be
+    parsed confidently and the LLM validator should decide.
+    """
+    try:
+        statements = sqlglot.parse(sql, dialect="sqlite")
+    except sqlglot.errors.ParseError as e:
+        # Keyword hits only hard-reject when the statement cannot be parsed;
+        # on a parsed SELECT they are literals or function names
+        if is_forbidden_sql(sql):
+            return {"status": "rejected", "reason": "Query contains a forbidden write/DDL keyword"}
+        return {"status": "ambiguous", "reason": f"Could not parse SQL: {e}"}
+
+    if len(statements) != 1:
+        return {"status": "rejected", "reason": "Multi-statement SQL is not allowed"}
+    if not isinstance(statements[0], sqlglot_exp.Select):
+        return {"status": "rejected", "reason": "Only SELECT queries are allowed"}
+
+    if is_forbidden_sql(sql):
+        # A write keyword inside a parsed SELECT (REPLACE() call, a string
+        # literal mentioning "delete", ...) is not proof of a write; let the
+        # LLM validator decide instead of rejecting a valid read
+        return {"status": "ambiguous", "reason": "Write/DDL keyword inside a SELECT statement"}
+
+    schema_lower = schema.lower() if schema else ""
+    if schema_lower:
+        # CTE aliases are defined by the query itself, not the schema
+        cte_names = {cte.alias_or_name.lower() for cte in statements[0].ctes}
+        for table in statements[0].find_all(sqlglot_exp.Table):
+            if not table.name or table.name.lower() in cte_names:
+                continue
+            if table.name.lower() not in schema_lower:
+                return {"status": "rejected", "reason": f"Unknown table: {table.name}"}
+        for column in statements[0].find_all(sqlglot_exp.Column):
+            if column.name and column.name.lower() not in schema_lower:
+                return {"status": "ambiguous", "reason": f"Column not found in schema: {column.name}"}
+
+    return {"status": "approved", "approved_sql": enforce_limit(sql)}
+
+
+@functools.lru_cache(maxsize=2048)
 def enforce_limit(sql: str, max_limit: int = MAX_LIMIT) -> str:
-    """Ensure the SQL has a LIMIT; if present, cap it."""
-    m = re.search(r"(?i)\blimit\s+(\d+)", sql)
+    """Ensure the SQL has a LIMIT; if present, cap it.
+
+    Pure in (sql, max_limit), so results are memoized for recurring SQL;
+    this also makes repeated application in a chain idempotent and free.
+    """
+    m = _LIMIT_RE.search(sql)
     if m:
         existing = int(m.group(1))
         if existing > max_limit:
-            sql = re.sub(r"(?i)\blimit\s+\d+", f"LIMIT {max_limit}", sql)
+            sql = _LIMIT_SUB_RE.sub(f"LIMIT {max_limit}", sql)
     else:
         sql = sql.rstrip(";") + f" LIMIT {DEFAULT_USER_LIMIT}"
     return sql
 
+def _tool_payload(result: Any, default: Any) -> Any:
+    """Extract the JSON payload from a FastMCP tool result."""
+    if result.data:
+        return result.data
+    if result.content and result.content[0].text:
+        return orjson.loads(result.content[0].text)
+    return default
+
+# ============== SQL Batcher ==============
+class SqlBatcher:
+    """Coalesces concurrent run_sql calls into one MCP round-trip per database.
+
+    Submissions are queued and drained every ~20 ms by a background task;
+    queries grouped by database go out as a single run_sql_bulk call,
+    amortizing the MCP round-trip across concurrent requests.
+    """
+
+    def __init__(self, interval: float = 0.02, max_batch: int = 32):
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._interval = interval
+        self._max_batch = max_batch
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._drain_loop())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def submit(self, db_name: str, query: str) -> Dict[str, Any]:
+        # Lazy start: callers that build workflows without going through
+        # initialize_workflow (e.g. main.py) must not await a queue that
+        # nothing drains
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((db_name, query, future))
+        return await future
+
+    async def _drain_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self._interval)
+            batch = []
+            while len(batch) < self._max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+            if not batch:
+                continue
+            groups: Dict[str, list] = {}
+            for db_name, query, future in batch:
+                groups.setdefault(db_name, []).append((query, future))
+            await asyncio.gather(
+                *(self._run_group(db_name, items) for db_name, items in groups.items())
+            )
+
+    async def _run_group(self, db_name: str, items: list) -> None:
+        queries = [query for query, _ in items]
+        try:
+            # The workflow consumes dict-per-row results (the executor prompt
+            # and FinalFormatter both expect them), so ask the server for the
+            # records shape rather than its columnar default
+            if len(queries) == 1:
+                result = await mcp.call_tool(
+                    "run_sql",
+                    {"db_name": db_name, "query": queries[0], "return_format": "records"},
+                )
+                payloads = [_tool_payload(result, {"result": []})]
+            else:
+                result = await mcp.call_tool(
+                    "run_sql_bulk",
+                    {"db_name": db_name, "queries": queries, "return_format": "records"},
+                )
+                payloads = _tool_payload(result, {"results": []}).get("results", [])
+        except Exception as e:
+            for _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), payload in zip(items, payloads):
+            if not future.done():
+                future.set_result(payload)
+        # A short bulk response must still resolve every submitter; a leaked
+        # pending future would hang its caller forever
+        for _, future in items[len(payloads):]:
+            if not future.done():
+                future.set_exception(
+                    RuntimeError("run_sql_bulk returned fewer results than queries")
+                )
+
+sql_batcher = SqlBatcher()
+
+# ============== Schema Injector Executor ==============
+class SchemaInjector(Executor):
+    """Prefetches every database schema in parallel and prepends the bundle
+    to the user's question, replacing the Database Selector agent's serial
+    list_databases/get_schema tool calls with one concurrent fetch.
+    """
+
+    def __init__(self, prefetch, id: str = "schema-injector"):
+        super().__init__(id=id)
+        self._prefetch = prefetch
+
+    @handler
+    async def inject(self, question: str, ctx: WorkflowContext[str]) -> None:
+        bundle = await self._prefetch()
+        # Static-first ordering: the schema bundle is identical across
+        # requests, so placing it before the question keeps the cacheable
+        # prompt prefix as long as possible
+        await ctx.send_message(
+            f"Available databases and schemas:\n{bundle}\n\nUser question: {question}"
+        )
+
+# ============== Self-Consistent Generator Executor ==============
+SELF_CONSISTENCY_TEMPERATURES = (0.0, 0.4, 0.8)
+
+class SelfConsistentGenerator(Executor):
+    """Runs K SQL Generator agents concurrently and majority-votes the SQL.
+
+    The candidate generations overlap their network I/O via asyncio.gather,
+    so K-way self-consistency costs roughly one generation latency instead
+    of K. Candidates that fail local validation are discarded before voting.
+    """
+
+    def __init__(self, agents: list, id: str = "self-consistent-generator"):
+        super().__init__(id=id)
+        self._agents = agents
+
+    @handler
+    async def generate(self, prompt: str, ctx: WorkflowContext[str]) -> None:
+        responses = await asyncio.gather(
+            *[agent.run(prompt) for agent in self._agents], return_exceptions=True
+        )
+
+        candidates = []
+        for response in responses:
+            if isinstance(response, BaseException):
+                continue
+            try:
+                payload = orjson.loads(response.text)
+            except orjson.JSONDecodeError:
+                continue
+            sql = payload.get("query", "")
+            selected_db = payload.get("selected_db", "")
+            if not sql:
+                continue
+            cached = _schema_cache.get(selected_db)
+            schema = "\n".join(cached[1].get("schema", [])) if cached else ""
+            if validate_sql_local(sql, schema)["status"] == "rejected":
+                continue
+            candidates.append((selected_db, " ".join(sql.split()).lower(), sql))
+
+        if not candidates:
+            # No candidate survived validation; pass the first raw response
+            # through so the downstream validator can report the rejection
+            for response in responses:
+                if not isinstance(response, BaseException):
+                    await ctx.send_message(response.text)
+                    return
+            raise RuntimeError("All SQL generator candidates failed")
+
+        counts = Counter(normalized for _, normalized, _ in candidates)
+        winner = counts.most_common(1)[0][0]
+        selected_db, _, sql = next(c for c in candidates if c[1] == winner)
+        # Native dict hop to the local validator; no re-serialization
+        await ctx.send_message({"selected_db": selected_db, "query": sql})
+
+# ============== Local Validator Executor ==============
+class LocalValidator(Executor):
+    """Validates generated SQL deterministically, skipping the LLM validator.
+
+    Approved/rejected verdicts are forwarded straight to the SQL executor;
+    only queries that sqlglot cannot settle are handed to the Validator agent.
+    """
+
+    @handler
+    async def validate(self, response: AgentExecutorResponse, ctx: WorkflowContext[str]) -> None:
+        await self.validate_text(response.agent_run_response.text, ctx)
+
+    @handler
+    async def validate_text(self, text: str, ctx: WorkflowContext[str]) -> None:
+        # Raw text hop, either unwrapped agent output or the self-consistency
+        # fallback when no candidate survived local validation
+        try:
+            payload = orjson.loads(text)
+        except orjson.JSONDecodeError:
+            # Malformed generator output; let the LLM validator untangle it
+            await ctx.send_message(text)
+            return
+        if not isinstance(payload, dict):
+            await ctx.send_message(text)
+            return
+        await self._validate_payload(payload, ctx, raw_text=text)
+
+    @handler
+    async def validate_dict(self, payload: Dict[str, Any], ctx: WorkflowContext[str]) -> None:
+        # Native dict hop from a local executor — no parsing needed
+        await self._validate_payload(payload, ctx)
+
+    async def _validate_payload(
+        self, payload: Dict[str, Any], ctx: WorkflowContext[str], raw_text: Optional[str] = None
+    ) -> None:
+        sql = payload.get("query", "")
+        selected_db = payload.get("selected_db", "")
+
+        cached = _schema_cache.get(selected_db)
+        schema = "\n".join(cached[1].get("schema", [])) if cached else ""
+        verdict = validate_sql_local(sql, schema)
+
+        if verdict["status"] == "ambiguous":
+            # The LLM validator needs text; serialize only on this path
+            await ctx.send_message(raw_text if raw_text is not None else json.dumps(payload))
+        elif verdict["status"] == "approved":
+            await ctx.send_message(json.dumps({
+                "status": "approved",
+                "selected_db": selected_db,
+                "approved_sql": verdict["approved_sql"],
+            }))
+        else:
+            await ctx.send_message(json.dumps({
+                "status": "rejected",
+                "reason": verdict["reason"],
+            }))
+
+
+def _is_local_verdict(message: Any) -> bool:
+    """True for verdict JSON emitted by LocalValidator (routed to the executor)."""
+    return isinstance(message, str) and '"status"' in message
+
+def _needs_llm_validation(message: Any) -> bool:
+    """True for generator output LocalValidator could not settle."""
+    return not _is_local_verdict(message)
+
+# ============== Final Formatter Executor ==============
+_RESULTS_TEMPLATE = jinja2.Template(
+    "Found {{ num_rows }} record{{ '' if num_rows == 1 else 's' }} matching your query.\n\n"
+    "| {{ columns | join(' | ') }} |\n"
+    "|{% for _ in columns %} --- |{% endfor %}\n"
+    "{% for row in rows %}| {{ row | join(' | ') }} |\n{% endfor %}"
+)
+
+class FinalFormatter(Executor):
+    """Renders the SQL executor's JSON result into the final reply locally.
+
+    Formatting query results is a deterministic template task, so the last
+    LLM roundtrip is skipped entirely; the final LLM agent is only used as
+    a fallback when the payload shape is unexpected.
+    """
+
+    @handler
+    async def format(self, response: AgentExecutorResponse, ctx: WorkflowContext[str, str]) -> None:
+        text = response.agent_run_response.text
+        try:
+            payload = orjson.loads(text)
+        except orjson.JSONDecodeError:
+            await ctx.send_message(text)
+            return
+        if not isinstance(payload, dict) or "status" not in payload:
+            await ctx.send_message(text)
+            return
+
+        if payload.get("status") == "error":
+            error = payload.get("error") or payload.get("results") or "unknown error"
+            await ctx.yield_output(f"{ERROR_REPLY_PREFIX} {error}")
+            return
+
+        results = payload.get("results") or []
+        if not results:
+            await ctx.yield_output("No records found matching your criteria.")
+            return
+        if not isinstance(results, list) or not all(isinstance(r, dict) for r in results):
+            await ctx.send_message(text)
+            return
+
+        num_rows = payload.get("num_rows", len(results))
+        columns = list(results[0].keys())
+
+        # Single-aggregate shortcut, e.g. {"count(*)": 27}
+        if num_rows == 1 and len(columns) == 1 and "count(" in columns[0].lower():
+            value = next(iter(results[0].values()))
+            await ctx.yield_output(f"The total number of matching records is {value}.")
+            return
+
+        rows = [[str(row.get(col, "")) for col in columns] for row in results]
+        await ctx.yield_output(
+            _RESULTS_TEMPLATE.render(num_rows=num_rows, columns=columns, rows=rows)
+        )
+
 # ============== Setup Workflow ==============
-async def setup_workflow():
-    """Initialize the workflow with all agents"""
+async def _open_mcp():
+    """Open the persistent MCP connection if it isn't already up.
+
+    The connection is kept for the life of the app; per-call
+    `async with mcp:` would redo the transport handshake each time.
+    """
     global mcp
-    mcp = FastMCPClient("http://localhost:8001/mcp/")
+    async with _mcp_lock:
+        if mcp is None:
+            mcp = FastMCPClient("http://localhost:8001/mcp/")
+            await mcp.__aenter__()
+
+_mcp_lock = asyncio.Lock()
+
+async def setup_workflow(self_consistency: bool = False):
+    """Initialize the workflow with all agents"""
+    await _open_mcp()
 
     async def list_dbs_func():
-        async with mcp:
-            result = await mcp.call_tool("list_databases", {})
-            if result.data:
-                return result.data
-            elif result.content and result.content[0].text:
-                return json.loads(result.content[0].text)
-            return {"databases": []}
+        global _dblist_cache
+        if _dblist_cache and time.monotonic() - _dblist_cache[0] < SCHEMA_CACHE_TTL:
+            return _dblist_cache[1]
+        result = await mcp.call_tool("list_databases", {})
+        if result.data:
+            data = result.data
+        elif result.content and result.content[0].text:
+            data = orjson.loads(result.content[0].text)
+        else:
+            data = {"databases": []}
+        _dblist_cache = (time.monotonic(), data)
+        return data
 
     async def get_schema_func(db_name: str) -> Dict[str, Any]:
-        async with mcp:
-            result = await mcp.call_tool("get_schema", {"db_name": db_name})
-            if result.data:
-                return result.data
-            elif result.content and result.content[0].text:
-                return json.loads(result.content[0].text)
-            return {"schema": []}
+        cached = _schema_cache.get(db_name)
+        if cached and time.monotonic() - cached[0] < SCHEMA_CACHE_TTL:
+            return cached[1]
+        result = await mcp.call_tool("get_schema", {"db_name": db_name})
+        if result.data:
+            data = result.data
+        elif result.content and result.content[0].text:
+            data = orjson.loads(result.content[0].text)
+        else:
+            data = {"schema": []}
+        _schema_cache[db_name] = (time.monotonic(), data)
+        return data
 
     async def run_sql_func(db_name: str, query: str) -> Dict[str, Any]:
-        async with mcp:
-            result = await mcp.call_tool("run_sql", {"db_name": db_name, "query": query})
-            if result.data:
-                return result.data
-            elif result.content and result.content[0].text:
-                return json.loads(result.content[0].text)
-            return {"result": [], "error": None}
+        return await sql_batcher.submit(db_name, query)
 
-    # Create AIFunction tools
-    list_dbs_tool = AIFunction(
-        name="list_databases",
-        description="List available SQLite DBs",
-        func=list_dbs_func
-    )
+    async def prefetch_all_schemas() -> str:
+        """Fetch every database schema and build one text bundle.
 
-    get_schema_tool = AIFunction(
-        name="get_schema",
-        description="Get schema (CREATE TABLE) for a DB",
-        func=get_schema_func
-    )
+        Prefers the batch get_all_schemas tool (one MCP round-trip for all
+        databases); falls back to gathering per-database fetches against an
+        older MCP server that lacks it.
+        """
+        global _bundle_cache
+        if _bundle_cache and time.monotonic() - _bundle_cache[0] < SCHEMA_CACHE_TTL:
+            return _bundle_cache[1]
+
+        try:
+            result = await mcp.call_tool("get_all_schemas", {})
+            schemas = _tool_payload(result, {"schemas": {}}).get("schemas", {})
+        except Exception:
+            schemas = None
 
+        if schemas:
+            # Warm the per-db cache so the local validator sees fresh schemas
+            now = time.monotonic()
+            for db, statements in schemas.items():
+                _schema_cache[db] = (now, {"schema": statements})
+        else:
+            dbs = (await list_dbs_func()).get("databases", [])
+            fetched = await asyncio.gather(*[get_schema_func(db) for db in dbs])
+            schemas = {db: s.get("schema", []) for db, s in zip(dbs, fetched)}
+
+        bundle = "\n\n".join(
+            f"Database: {db}\n" + "\n".join(statements)
+            for db, statements in schemas.items()
+        )
+        _bundle_cache = (time.monotonic(), bundle)
+        return bundle
+
+    # Create AIFunction tools
     run_sql_tool = AIFunction(
         name="run_sql",
         description="Run SQL query on DB",
@@ -237,123 +879,233 @@ async def setup_workflow():
     )
 
     # Create agents
-    db_selector_agent = client_open.create_agent(
-        name="Database Selector",
-        instructions=DB_SELECTOR_PROMPT,
-        tools=[list_dbs_tool, get_schema_tool],
-    )
-
     sql_generator_agent = client_open.create_agent(
         name="SQL Generator",
         instructions=Prompt_nlp_sql,
         tools=[],
+        **_cached_prompt_kwargs("sql_generator"),
     )
 
     validator_agent = client_open.create_agent(
         name="Validator-Agent",
         instructions=Prompt_validator,
         tools=[],
+        **_cached_prompt_kwargs("validator"),
     )
 
     sql_executor_agent = client_open.create_agent(
         name="SQL Executor",
         instructions=SQL_EXECUTOR_PROMPT,
         tools=[run_sql_tool],
+        **_cached_prompt_kwargs("sql_executor"),
     )
 
     final_agent = client_open.create_agent(
-        name="final-Agent",
-        instructions="""
-        You are the final agent in the workflow. Your role is to process the output from the previous agent and present it as a clear and concise final result for the user.
-
-        Guidelines:
-        1. If the previous agent's output contains results, summarize the key information in a user-friendly format.
-        2. If no results are found, explicitly state that no matching records were retrieved.
-        3. Ensure the output is well-structured, easy to understand, and free of unnecessary details.
-
-        Example:
-        Input:
-        {
-        "database_used": "orders",
-        "sql_executed": "SELECT count(T1.`Order ID`) FROM order_table AS T1 INNER JOIN orders_table AS T2 ON T1.`Customer Name` = T2.`Customer Name` WHERE T2.`Customer Gender` = 'Female' LIMIT 50",
-        "num_rows": 1,
-        "results": [
-            {
-            "count(T1.`Order ID`)": 27
-            }
-        ],
-        "status": "success"
-        }
-
-        Output:
-        "The total number of orders placed by female customers is 27."
-
-        If no results are found:
-        "No matching records were found based on the query."
-        """,
+        name=FINAL_AGENT_NAME,
+        instructions=Final_Agent_Prompt,
         tools=[],
+        **_cached_prompt_kwargs("final"),
     )
 
+    schema_injector = SchemaInjector(prefetch_all_schemas)
+    local_validator = LocalValidator(id="local-validator")
+
+    if self_consistency:
+        # K concurrent generator candidates at different temperatures,
+        # majority-voted after local validation
+        generator = SelfConsistentGenerator([
+            client_open.create_agent(
+                name=f"SQL Generator {i}",
+                instructions=Prompt_nlp_sql,
+                tools=[],
+                temperature=temperature,
+                **_cached_prompt_kwargs("sql_generator"),
+            )
+            for i, temperature in enumerate(SELF_CONSISTENCY_TEMPERATURES)
+        ])
+    else:
+        generator = sql_generator_agent
+
     builder = WorkflowBuilder()
-    builder.add_agent(db_selector_agent)
-    builder.add_agent(sql_generator_agent)
+    if not self_consistency:
+        builder.add_agent(sql_generator_agent)
     builder.add_agent(validator_agent)
     builder.add_agent(sql_executor_agent)
-    builder.set_start_executor(db_selector_agent)
-    builder.add_edge(db_selector_agent, sql_generator_agent)
-    builder.add_edge(sql_generator_agent, validator_agent)
+    builder.set_start_executor(schema_injector)
+    builder.add_edge(schema_injector, generator)
+    # Deterministic validation first; the LLM validator only sees queries
+    # that sqlglot could not settle
+    builder.add_edge(generator, local_validator)
+    builder.add_edge(local_validator, sql_executor_agent, condition=_is_local_verdict)
+    builder.add_edge(local_validator, validator_agent, condition=_needs_llm_validation)
     builder.add_edge(validator_agent, sql_executor_agent)
-    builder.add_edge(sql_executor_agent, final_agent)
-    
+    # Deterministic formatting of executor results; the final LLM agent only
+    # sees payloads whose shape the formatter could not handle
+    final_formatter = FinalFormatter(id="final-formatter")
+    builder.add_edge(sql_executor_agent, final_formatter)
+    builder.add_edge(final_formatter, final_agent)
+
     return builder.build()
 
 # ============== Global Workflow Instance ==============
 
 workflow = None
+workflow_sc = None
 
 async def initialize_workflow():
-    global workflow
+    global workflow, workflow_sc, _prompt_cache_refresh_task
+    await _register_prompt_caches()
+    if _prompt_cache_ids:
+        _prompt_cache_refresh_task = asyncio.create_task(_refresh_prompt_caches())
     workflow = await setup_workflow()
-    print("✓ Workflow initialized")
+    workflow_sc = await setup_workflow(self_consistency=True)
+    sql_batcher.start()
+    logger.info("Workflow initialized")
 
 # ============== API Endpoints ==============
 
-@app.on_event("startup")
-async def startup_event():
-    await initialize_workflow()
+@app.post("/admin/invalidate_cache")
+async def invalidate_cache():
+    """Drop the cached database list and schemas (e.g., after a DB change)"""
+    _invalidate_mcp_caches()
+    return {"status": "ok"}
 
 @app.get("/health")
 async def health_check():
-    return {"status": "ok"}
+    return {"status": "ok", "semantic_cache": semantic_cache.stats()}
 
 @app.post("/query", response_model=QueryResponse)
-async def process_query(request: QueryRequest):
-    """Process a user query through the workflow"""
+async def process_query(request: QueryRequest, self_consistency: bool = False):
+    """Process a user query through the workflow.
+
+    With ?self_consistency=true, SQL generation runs K candidates
+    concurrently and majority-votes the winner.
+    """
     if not workflow:
         raise HTTPException(status_code=503, detail="Workflow not initialized")
 
     if not request.question or not request.question.strip():
         raise HTTPException(status_code=400, detail="Question cannot be empty")
 
+    # L0: keyword pre-router for queries that must not reach the workflow
+    canned = _quick_route(request.question)
+    if canned is not None:
+        return QueryResponse(status="success", response=canned)
+
+    # L1: exact-match cache (one hash + one dict lookup)
+    exact_key = _exact_cache_key(request.question)
+    if exact_key in _exact_cache:
+        _exact_cache.move_to_end(exact_key)
+        return QueryResponse(status="success", response=_exact_cache[exact_key])
+
+    # L2: semantic cache before running the full workflow
+    # The embedding encode is CPU-bound sync work; keep it off the event loop
+    cached = await asyncio.to_thread(
+        semantic_cache.lookup, request.question, SEMANTIC_CACHE_THRESHOLD
+    )
+    if cached is not None:
+        return QueryResponse(status="success", response=cached)
+
+    await _acquire_workflow_slot()
     try:
-        response_text=""
-        events = await workflow.run(request.question)
-        for event in events:
-            if isinstance(event, AgentRunEvent):
-                # print(type(event.data.text))
-                response_text=event.data
-                print(f"{event.executor_id}: {event.data}")
-
-        print(f"{'=' * 60}\nWorkflow Outputs: {events.get_outputs()}")
-        # Summarize the final run state (e.g., COMPLETED)
-        print("Final state:", events.get_final_state())
-        
+        active_workflow = workflow_sc if self_consistency and workflow_sc else workflow
+        events = await active_workflow.run(request.question)
+
+        if logger.isEnabledFor(logging.DEBUG):
+            # Lazy %s formatting: no per-event stringification unless DEBUG is on
+            for event in events:
+                if isinstance(event, AgentRunEvent):
+                    logger.debug("%s: %s", event.executor_id, event.data)
+            logger.debug("Final state: %s", events.get_final_state())
+
+        # The workflow's output API is authoritative: the FinalFormatter
+        # (or the terminal fallback agent) yields the reply as an output,
+        # so there is no need to scan and clobber through every event
+        outputs = events.get_outputs()
+        final_text = str(outputs[-1]) if outputs else _last_agent_text(events)
+
+        if _is_cacheable_reply(final_text):
+            await asyncio.to_thread(semantic_cache.insert, request.question, final_text)
+            async with _exact_cache_lock:
+                _exact_cache[exact_key] = final_text
+                while len(_exact_cache) > EXACT_CACHE_MAX_ENTRIES:
+                    _exact_cache.popitem(last=False)
+
         return QueryResponse(
             status="success",
-            response=response_text.text
+            response=final_text
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+    finally:
+        _workflow_sem.release()
+
+@app.post("/query/stream")
+async def process_query_stream(request: QueryRequest):
+    """Stream the final agent's reply as Server-Sent Events.
+
+    Unlike /query, which buffers until all agents finish, this starts
+    emitting as soon as the final agent produces its first tokens.
+    """
+    if not workflow:
+        raise HTTPException(status_code=503, detail="Workflow not initialized")
+
+    if not request.question or not request.question.strip():
+        raise HTTPException(status_code=400, detail="Question cannot be empty")
+
+    canned = _quick_route(request.question)
+    if canned is not None:
+        async def canned_gen():
+            yield f"data: {json.dumps({'delta': canned})}\n\n"
+            yield "data: [DONE]\n\n"
+        return StreamingResponse(canned_gen(), media_type="text/event-stream")
+
+    exact_key = _exact_cache_key(request.question)
+    cached = _exact_cache.get(exact_key)
+    if cached is None:
+        cached = await asyncio.to_thread(
+            semantic_cache.lookup, request.question, SEMANTIC_CACHE_THRESHOLD
+        )
+
+    if cached is None:
+        # Acquire the slot before the response starts: once the 200 headers
+        # and SSE stream are underway, a 429 would surface as a silently
+        # truncated stream instead of an error the client can handle
+        await _acquire_workflow_slot()
+
+    async def gen():
+        if cached is not None:
+            yield f"data: {json.dumps({'delta': cached})}\n\n"
+            yield "data: [DONE]\n\n"
+            return
+
+        chunks: List[str] = []
+        try:
+            async for event in workflow.run_stream(request.question):
+                if isinstance(event, WorkflowOutputEvent) and event.data is not None:
+                    delta = str(event.data)
+                    chunks.append(delta)
+                    yield f"data: {json.dumps({'delta': delta})}\n\n"
+                elif isinstance(event, AgentRunUpdateEvent) and event.executor_id == FINAL_AGENT_NAME:
+                    if event.data is not None:
+                        delta = str(event.data)
+                        chunks.append(delta)
+                        yield f"data: {json.dumps({'delta': delta})}\n\n"
+        finally:
+            _workflow_sem.release()
+
+        final_text = "".join(chunks)
+        if _is_cacheable_reply(final_text):
+            await asyncio.to_thread(semantic_cache.insert, request.question, final_text)
+            async with _exact_cache_lock:
+                _exact_cache[exact_key] = final_text
+                while len(_exact_cache) > EXACT_CACHE_MAX_ENTRIES:
+                    _exact_cache.popitem(last=False)
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(gen(), media_type="text/event-stream")
 
 @app.get("/")
 async def root():
@@ -365,4 +1117,14 @@ async def root():
 # ============== Main ==============
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    workers = int(os.getenv("WORKERS", "1"))
+    uvicorn.run(
+        # uvicorn can only fork workers from an import string; passing the
+        # app object with workers > 1 makes it refuse to start
+        "Backend.backend:app" if workers > 1 else app,
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        workers=workers,
+    )
@@ -0,0 +1,114 @@
+"""
+Semantic response cache for the Customer Support MAF Backend.
+
+Caches final workflow responses keyed by an embedding of the user's
+question, so repeated or paraphrased questions are answered from memory
+instead of re-running the full multi-agent workflow.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+# ============== Constants ==============
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+DEFAULT_THRESHOLD = 0.87
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_TTL_SECONDS = 7 * 24 * 3600  # 7 days
+
+
+class SemanticCache:
+    """In-memory semantic cache over L2-normalized sentence embeddings.
+
+    Lookup computes cosine similarity (dot product of normalized vectors)
+    between the incoming question and every cached question; a hit requires
+    similarity >= threshold and an entry younger than the TTL. Entries are
+    evicted LRU once max_entries is reached.
+    """
+
+    def __init__(
+        self,
+        model_name: str = EMBEDDING_MODEL,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        ttl_seconds: float = DEFAULT_TTL_SECONDS,
+    ):
+        self._model = SentenceTransformer(model_name)
+        self._max_entries = max_entries
+        self._ttl_seconds = ttl_seconds
+        # key: normalized question -> (embedding, response_text, created_at)
+        self._entries: OrderedDict[str, tuple[np.ndarray, str, float]] = OrderedDict()
+        # lookup/insert run on worker threads (asyncio.to_thread); the lock
+        # keeps the similarity scan's index aligned with the key order
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _embed(self, text: str) -> np.ndarray:
+        vec = self._model.encode(text, convert_to_numpy=True)
+        norm = np.linalg.norm(vec)
+        if norm > 0:
+            vec = vec / norm
+        return vec.astype(np.float32)
+
+    @staticmethod
+    def _normalize(question: str) -> str:
+        # Lowercase, collapse whitespace, drop trailing punctuation so
+        # trivially different phrasings share one entry
+        return " ".join(question.lower().strip().rstrip("?.!").split())
+
+    def _purge_expired(self) -> None:
+        now = time.time()
+        expired = [
+            key for key, (_, _, created_at) in self._entries.items()
+            if now - created_at > self._ttl_seconds
+        ]
+        for key in expired:
+            del self._entries[key]
+
+    def lookup(self, question: str, threshold: float = DEFAULT_THRESHOLD) -> Optional[str]:
+        """Return the cached response for a semantically similar question, or None."""
+        # Embed outside the lock (slow, touches no shared state); the scan
+        # itself must hold it so the similarity row index stays aligned
+        # with the key order under concurrent inserts
+        query_vec = self._embed(self._normalize(question))
+
+        with self._lock:
+            self._purge_expired()
+            if not self._entries:
+                self.misses += 1
+                return None
+
+            matrix = np.stack([entry[0] for entry in self._entries.values()])
+            similarities = matrix @ query_vec
+            best_idx = int(np.argmax(similarities))
+
+            if similarities[best_idx] >= threshold:
+                key = list(self._entries.keys())[best_idx]
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][1]
+
+            self.misses += 1
+            return None
+
+    def insert(self, question: str, response_text: str) -> None:
+        """Store a response under the question's embedding, evicting LRU if full."""
+        key = self._normalize(question)
+        embedding = self._embed(key)
+        with self._lock:
+            self._entries[key] = (embedding, response_text, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        """Hit/miss counters and current size, for the /health endpoint."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._entries),
+        }
@@ -4,7 +4,7 @@ User-friendly interface for interacting with the backend API
 """
 
 import streamlit as st
-import requests
+import httpx
 import json
 from typing import Optional
 from datetime import datetime
@@ -79,29 +79,44 @@ if "query_history" not in st.session_state:
 if "last_response" not in st.session_state:
     st.session_state.last_response = None
 
+if "history_window" not in st.session_state:
+    st.session_state.history_window = 20
+
 # ============== Helper Functions ==============
 
+@st.cache_resource
+def get_client(base_url: str) -> httpx.Client:
+    """Pooled HTTP client, one per backend URL.
+
+    cache_resource keeps the connection pool alive across Streamlit reruns,
+    so repeated queries reuse the TCP connection instead of paying a
+    handshake per call.
+    """
+    return httpx.Client(base_url=base_url, timeout=60.0)
+
+@st.cache_data(ttl=HEALTH_CHECK_INTERVAL)
 def check_api_health():
-    """Check if the backend API is available"""
+    """Check if the backend API is available.
+
+    Cached so UI reruns don't pay an HTTP round-trip per interaction;
+    the caller updates session state from the returned value.
+    """
     try:
-        response = requests.get(f"{API_BASE_URL}/health", timeout=5)
+        response = get_client(API_BASE_URL).get("/health", timeout=1)
         if response.status_code == 200:
-            data = response.json()
-            st.session_state.api_available = True
-            return data
-    except requests.exceptions.RequestException:
-        st.session_state.api_available = False
+            return response.json()
+    except httpx.HTTPError:
+        pass
     return None
 
 def process_query(question: str) -> Optional[dict]:
     """Send query to backend API and get response"""
     try:
-        response = requests.post(
-            f"{API_BASE_URL}/query",
-            json={"question": question},
-            timeout=60
+        response = get_client(API_BASE_URL).post(
+            "/query",
+            json={"question": question}
         )
-        
+
         if response.status_code == 200:
             return response.json()
         else:
@@ -109,10 +124,46 @@ def process_query(question: str) -> Optional[dict]:
             if response.text:
                 st.error(response.text)
             return None
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
+        st.error("Request timed out. The query may be taking too long. Please try again.")
+        return None
+    except httpx.ConnectError:
+        st.error("Cannot connect to the backend API. Please ensure the server is running.")
+        return None
+    except Exception as e:
+        st.error(f"Error: {str(e)}")
+        return None
+
+def process_query_stream(question: str, placeholder) -> Optional[dict]:
+    """Stream the response via SSE, rendering each delta as it arrives"""
+    try:
+        with get_client(API_BASE_URL).stream(
+            "POST",
+            "/query/stream",
+            json={"question": question}
+        ) as response:
+            if response.status_code != 200:
+                response.read()
+                st.error(f"API Error: {response.status_code}")
+                if response.text:
+                    st.error(response.text)
+                return None
+
+            full_text = ""
+            for line in response.iter_lines():
+                if not line or not line.startswith("data: "):
+                    continue
+                data = line[len("data: "):]
+                if data == "[DONE]":
+                    break
+                full_text += json.loads(data).get("delta", "")
+                placeholder.markdown(full_text + " ▌")
+            placeholder.markdown(full_text)
+            return {"status": "success", "response": full_text}
+    except httpx.TimeoutException:
         st.error("Request timed out. The query may be taking too long. Please try again.")
         return None
-    except requests.exceptions.ConnectionError:
+    except httpx.ConnectError:
         st.error("Cannot connect to the backend API. Please ensure the server is running.")
         return None
     except Exception as e:
@@ -147,6 +198,7 @@ with col1:
 
 with col2:
     health_status = check_api_health()
+    st.session_state.api_available = health_status is not None
     if st.session_state.api_available:
         st.success("✅ Backend Connected", icon="✅")
         if health_status:
@@ -169,6 +221,12 @@ with st.sidebar:
     
     if api_url != API_BASE_URL:
         globals()["API_BASE_URL"] = api_url
+
+    stream_mode = st.checkbox(
+        "Stream responses",
+        value=True,
+        help="Show the answer as it is generated instead of waiting for the full response"
+    )
     
     st.markdown("### About")
     st.info("""
@@ -228,22 +286,29 @@ with tab1:
         elif not question.strip():
             st.warning("⚠️ Please enter a question.")
         else:
-            with st.spinner("🔄 Processing your query..."):
-                response = process_query(question)
-                
-                if response:
-                    st.session_state.last_response = response
-                    
-                    # Add to history
-                    st.session_state.query_history.append({
-                        "question": question,
-                        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                        "response": response
-                    })
-                    
-                    # Display response
+            if stream_mode:
+                st.markdown("### 📝 Response")
+                placeholder = st.empty()
+                response = process_query_stream(question, placeholder)
+            else:
+                with st.spinner("🔄 Processing your query..."):
+                    response = process_query(question)
+
+            if response:
+                st.session_state.last_response = response
+
+                # Add to history (preview precomputed so rerenders just read it)
+                st.session_state.query_history.append({
+                    "question": question,
+                    "preview": question[:50],
+                    "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                    "response": response
+                })
+
+                if not stream_mode:
+                    # Display response (streaming already rendered it above)
                     st.markdown("### 📝 Response")
-                    
+
                     if response.get("status") == "success":
                         st.markdown(f"""
                         <div class="response-box">
@@ -270,17 +335,28 @@ with tab2:
     st.markdown("### Query History")
     
     if st.session_state.query_history:
-        for idx, item in enumerate(reversed(st.session_state.query_history), 1):
-            with st.expander(f"**Query {len(st.session_state.query_history) - idx + 1}:** {item['question'][:50]}... ({item['timestamp']})"):
+        total = len(st.session_state.query_history)
+        # Render only the newest entries so the tab stays cheap regardless
+        # of history size; the window grows on demand
+        window = min(st.session_state.history_window, total)
+        for offset, item in enumerate(st.session_state.query_history[-window:][::-1]):
+            number = total - offset
+            preview = item.get("preview", item["question"][:50])
+            with st.expander(f"**Query {number}:** {preview}... ({item['timestamp']})"):
                 st.markdown("**Question:**")
                 st.text(item['question'])
-                
+
                 st.markdown("**Response:**")
                 response = item['response']
                 if response.get("status") == "success":
                     st.markdown(format_response(response))
                 else:
                     st.error(response.get("response", "Error"))
+
+        if window < total:
+            if st.button(f"Load more ({total - window} older)"):
+                st.session_state.history_window += 20
+                st.rerun()
     else:
         st.info("No query history yet. Start by asking a question!")
 
@@ -1,15 +1,108 @@
+from contextlib import contextmanager
 from fastmcp import FastMCP
+import functools
+import orjson
+import queue
 import sqlite3
-import glob
-import json
 import os
+import threading
+import time
 
 DB_DIR = "/Users/rahul/Desktop/Gen AI/AgenticOrch/Content/customer_support_maf_2/Databases"
 
-app = FastMCP("mcp-sql1")
+def _orjson_serializer(data):
+    """Serialize tool results with orjson; large run_sql payloads dominate
+    response time under the stdlib encoder."""
+    return orjson.dumps(data).decode()
+
+app = FastMCP("mcp-sql1", tool_serializer=_orjson_serializer)
+
+# Resolved paths are memoized per db_name; the name is checked against the
+# directory listing first, so traversal strings never reach the filesystem
+_PATH_CACHE: dict[str, str] = {}
 
 def get_db_path(db_name):
-    return f"{DB_DIR}/{db_name}.db"
+    path = _PATH_CACHE.get(db_name)
+    if path is None:
+        if db_name not in _list_db_names():
+            raise ValueError(f"Unknown database: {db_name}")
+        path = os.path.join(DB_DIR, db_name + ".db")
+        _PATH_CACHE[db_name] = path
+    return path
+
+
+# Long-lived connection per database: SQLite's page cache is per-connection
+# and thrown away on close, so connecting per tool call paid file-open plus
+# a cold cache every time. Connections are created lazily and never closed.
+# One writer per db; SELECTs run on a small pool of query_only readers so
+# concurrent reads under WAL never queue behind each other or the writer.
+READ_POOL_SIZE = 4
+_CONN_CACHE: dict[str, sqlite3.Connection] = {}
+_READ_POOLS: dict[str, queue.Queue] = {}
+_conn_lock = threading.Lock()
+
+def _new_conn(db_name, query_only=False):
+    conn = sqlite3.connect(
+        get_db_path(db_name),
+        check_same_thread=False,
+        isolation_level=None,
+        # Recurring query text stays prepared across tool calls
+        cached_statements=256,
+    )
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=normal")
+    conn.execute("PRAGMA temp_store=memory")
+    conn.execute("PRAGMA cache_size=-64000")
+    # mmap_size is per-connection: reads go through mmap'd pages
+    # instead of read() syscalls into the page cache
+    conn.execute("PRAGMA mmap_size=268435456")
+    if query_only:
+        conn.execute("PRAGMA query_only=ON")
+    return conn
+
+def _get_conn(db_name):
+    with _conn_lock:
+        conn = _CONN_CACHE.get(db_name)
+        if conn is None:
+            conn = _new_conn(db_name)
+            _CONN_CACHE[db_name] = conn
+        return conn
+
+@contextmanager
+def _read_conn(db_name):
+    """Check a query_only reader out of the per-db pool for one statement."""
+    with _conn_lock:
+        pool = _READ_POOLS.get(db_name)
+        if pool is None:
+            pool = queue.Queue()
+            for _ in range(READ_POOL_SIZE):
+                pool.put(_new_conn(db_name, query_only=True))
+            _READ_POOLS[db_name] = pool
+    conn = pool.get()
+    try:
+        yield conn
+    finally:
+        pool.put(conn)
+
+
+# Database list memo: re-scanning the directory on every call is wasted
+# stat traffic when the set of db files changes rarely
+_DBLIST_TTL = 5.0  # seconds
+_dblist_cache = None  # (monotonic timestamp, list of db names)
+
+def _list_db_names():
+    global _dblist_cache
+    if _dblist_cache and time.monotonic() - _dblist_cache[0] < _DBLIST_TTL:
+        return _dblist_cache[1]
+    # os.scandir with suffix slicing skips glob's fnmatch machinery
+    try:
+        with os.scandir(DB_DIR) as it:
+            dbs = [e.name[:-3] for e in it if e.is_file() and e.name.endswith(".db")]
+    except FileNotFoundError:
+        # Match the old glob behavior: a missing directory means no databases
+        dbs = []
+    _dblist_cache = (time.monotonic(), dbs)
+    return dbs
 
 
 @app.tool()
@@ -17,8 +110,23 @@ def list_databases():
     """
     Returns list of available Spider SQLite DBs.
     """
-    dbs = [os.path.basename(x).replace(".db", "") for x in glob.glob(DB_DIR + "/*.db")]
-    return {"databases": dbs}
+    return {"databases": _list_db_names()}
+
+
+# Schemas change only when a db file is rewritten, so they are cached per
+# database keyed on the file's mtime; repeated get_schema calls cost one
+# stat plus a dict lookup instead of any SQLite work.
+_SCHEMA_CACHE: dict[str, tuple[int, list[str]]] = {}
+
+def _fetch_schema(db_name):
+    mtime = os.stat(get_db_path(db_name)).st_mtime_ns
+    cached = _SCHEMA_CACHE.get(db_name)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    cursor = _get_conn(db_name).execute("SELECT sql FROM sqlite_master WHERE type='table'")
+    schema = [row[0] for row in cursor.fetchall()]
+    _SCHEMA_CACHE[db_name] = (mtime, schema)
+    return schema
 
 
 @app.tool()
@@ -26,37 +134,118 @@ def get_schema(db_name: str):
     """
     Fetch CREATE TABLE schema statements.
     """
-    path = get_db_path(db_name)
-    conn = sqlite3.connect(path)
-    cursor = conn.cursor()
+    return {"schema": _fetch_schema(db_name)}
 
-    cursor.execute("SELECT sql FROM sqlite_master WHERE type='table'")
-    schema = [row[0] for row in cursor.fetchall()]
 
-    conn.close()
-    return {"schema": schema}
+@app.tool()
+def get_all_schemas():
+    """
+    Fetch CREATE TABLE statements for every database in one round-trip.
+    """
+    return {"schemas": {db_name: _fetch_schema(db_name) for db_name in _list_db_names()}}
+
+
+# Rows drained from a cursor per fetchmany call
+ARRAYSIZE = 2000
+
+def _materialize(cursor, return_format):
+    """Build the result payload, columnar by default.
+
+    Columnar form sends the column names once instead of repeating them as
+    dict keys on every row; "records" rebuilds the dict-per-row shape for
+    clients that ask for it. Rows are drained in fetchmany batches so large
+    results never hold a second full-size intermediate list.
+    """
+    cursor.arraysize = ARRAYSIZE
+    columns = [d[0] for d in cursor.description] if cursor.description else []
+    if return_format == "records":
+        result = []
+        for chunk in iter(cursor.fetchmany, []):
+            result.extend(dict(zip(columns, r)) for r in chunk)
+        return {"result": result}
+    rows = []
+    for chunk in iter(cursor.fetchmany, []):
+        rows.extend(chunk)
+    return {"columns": columns, "rows": rows}
+
+
+# Non-deterministic SQL whose results must never be cached; the 'now'
+# literal covers date('now') / datetime('now') / strftime(..., 'now')
+_NONDETERMINISTIC = ("random(", "current_time", "current_date", "current_timestamp", "'now'")
+
+# Per-db write counter: under WAL, writes land in the -wal file and the main
+# db's mtime doesn't move until checkpoint, so mtime alone can't invalidate
+# cached reads after a write through run_sql. Every write bumps this counter,
+# which is part of the result-cache key; mtime still catches external rewrites.
+_DB_GENERATION: dict[str, int] = {}
+
+def _is_read_only(query):
+    stripped = query.lstrip()
+    first = stripped.split(None, 1)[0].upper() if stripped else ""
+    return first in ("SELECT", "WITH")
+
+
+def _is_cacheable(query):
+    """True for deterministic read-only queries (SELECT/WITH, no volatile functions)."""
+    if not _is_read_only(query):
+        return False
+    return not any(fn in query.lower() for fn in _NONDETERMINISTIC)
+
+
+@functools.lru_cache(maxsize=512)
+def _cached_run(db_name, sql, mtime_ns, generation, return_format):
+    # mtime_ns and generation are part of the key purely for invalidation:
+    # a rewritten db file or a write through run_sql changes the key, so
+    # stale results age out of the LRU naturally
+    with _read_conn(db_name) as conn:
+        return _materialize(conn.execute(sql), return_format)
+
+
+def _execute(db_name, query, return_format):
+    if _is_cacheable(query):
+        # The query text is cached verbatim: collapsing whitespace would
+        # also rewrite whitespace inside quoted string literals
+        mtime_ns = os.stat(get_db_path(db_name)).st_mtime_ns
+        generation = _DB_GENERATION.get(db_name, 0)
+        return _cached_run(db_name, query, mtime_ns, generation, return_format)
+    if _is_read_only(query):
+        with _read_conn(db_name) as conn:
+            return _materialize(conn.execute(query), return_format)
+    result = _materialize(_get_conn(db_name).execute(query), return_format)
+    # Invalidate cached reads and the schema for this db; WAL writes don't
+    # touch the main file's mtime until checkpoint
+    _DB_GENERATION[db_name] = _DB_GENERATION.get(db_name, 0) + 1
+    _SCHEMA_CACHE.pop(db_name, None)
+    return result
 
 
 @app.tool()
-def run_sql(db_name: str, query: str):
+def run_sql(db_name: str, query: str, return_format: str = "soa"):
     """
     Execute SQL on selected Spider DB.
+    Returns {"columns": [...], "rows": [...]} by default; pass
+    return_format="records" for one dict per row.
     """
-    path = get_db_path(db_name)
-    conn = sqlite3.connect(path)
-    cursor = conn.cursor()
-
     try:
-        cursor.execute(query)
-        rows = cursor.fetchall()
-        columns = [d[0] for d in cursor.description] if cursor.description else []
-        result = [dict(zip(columns, r)) for r in rows]
+        return _execute(db_name, query, return_format)
     except Exception as e:
         return {"error": str(e)}
-    finally:
-        conn.close()
 
-    return {"result": result}
+
+@app.tool()
+def run_sql_bulk(db_name: str, queries: list[str], return_format: str = "soa"):
+    """
+    Execute multiple SQL queries on one DB in a single round-trip.
+    Each entry uses the same result shape as run_sql.
+    """
+    results = []
+    for query in queries:
+        try:
+            results.append(_execute(db_name, query, return_format))
+        except Exception as e:
+            results.append({"error": str(e)})
+
+    return {"results": results}
 
 
 if __name__ == "__main__":
@@ -4,158 +4,185 @@ Tests the handoff orchestration and agent flows
 """
 
 import asyncio
+import io
 import json
 from Backend.backend import (
     setup_workflow,
-    context_manager,
     AgentRunEvent,
     WorkflowOutputEvent
 )
 
 
-async def test_order_query():
+def _events_by_type(events):
+    """Group a run's events by concrete type in one pass.
+
+    The tests only print AgentRunEvent traces; grouping once replaces a
+    per-event isinstance check in every loop over the stream.
+    """
+    by_type = {}
+    for event in events:
+        by_type.setdefault(type(event), []).append(event)
+    return by_type
+
+
+async def test_order_query(workflow):
     """Test order/ticket query routing to database pipeline"""
-    print("\n" + "="*80)
-    print("TEST 1: Order Query - Should route to Database Pipeline")
-    print("="*80)
+    # Buffer this test's trace and flush it atomically, so concurrently
+    # running tests don't interleave their output
+    out = io.StringIO()
+    print("\n" + "="*80, file=out)
+    print("TEST 1: Order Query - Should route to Database Pipeline", file=out)
+    print("="*80, file=out)
     
-    workflow = await setup_workflow()
     query = "What are the top 5 orders by customer name?"
     
-    print(f"\n📝 Query: {query}")
-    print(f"\n🔄 Running workflow...\n")
+    print(f"\n📝 Query: {query}", file=out)
+    print(f"\n🔄 Running workflow...\n", file=out)
     
     try:
         events = await workflow.run(query)
         
         # Print agent execution trace
-        for event in events:
-            if isinstance(event, AgentRunEvent):
-                print(f"  → {event.executor_id}: {event.data}")
+        for event in _events_by_type(events).get(AgentRunEvent, ()):
+            print(f"  → {event.executor_id}: {event.data}", file=out)
         
-        print(f"\n✅ Final State: {events.get_final_state()}")
+        print(f"\n✅ Final State: {events.get_final_state()}", file=out)
         outputs = events.get_outputs()
         if outputs:
-            print(f"📊 Outputs: {outputs}")
+            print(f"📊 Outputs: {outputs}", file=out)
             
     except Exception as e:
-        print(f"❌ Error: {str(e)}")
+        print(f"❌ Error: {str(e)}", file=out)
+    finally:
+        print(out.getvalue(), end="")
 
 
-async def test_fraud_query():
+async def test_fraud_query(workflow):
     """Test fraud detection query"""
-    print("\n" + "="*80)
-    print("TEST 2: Fraud Query - Should route to Fraud Detection Agent")
-    print("="*80)
+    # Buffer this test's trace and flush it atomically, so concurrently
+    # running tests don't interleave their output
+    out = io.StringIO()
+    print("\n" + "="*80, file=out)
+    print("TEST 2: Fraud Query - Should route to Fraud Detection Agent", file=out)
+    print("="*80, file=out)
     
-    workflow = await setup_workflow()
     query = "I suspect there's fraud on my account with unusual transactions"
     
-    print(f"\n📝 Query: {query}")
-    print(f"\n🔄 Running workflow...\n")
+    print(f"\n📝 Query: {query}", file=out)
+    print(f"\n🔄 Running workflow...\n", file=out)
     
     try:
         events = await workflow.run(query)
         
         # Print agent execution trace
-        for event in events:
-            if isinstance(event, AgentRunEvent):
-                print(f"  → {event.executor_id}: {event.data}")
+        for event in _events_by_type(events).get(AgentRunEvent, ()):
+            print(f"  → {event.executor_id}: {event.data}", file=out)
         
-        print(f"\n✅ Final State: {events.get_final_state()}")
+        print(f"\n✅ Final State: {events.get_final_state()}", file=out)
         outputs = events.get_outputs()
         if outputs:
-            print(f"📊 Outputs: {outputs}")
+            print(f"📊 Outputs: {outputs}", file=out)
             
     except Exception as e:
-        print(f"❌ Error: {str(e)}")
+        print(f"❌ Error: {str(e)}", file=out)
+    finally:
+        print(out.getvalue(), end="")
 
 
-async def test_billing_query():
+async def test_billing_query(workflow):
     """Test billing query"""
-    print("\n" + "="*80)
-    print("TEST 3: Billing Query - Should route to Final Agent")
-    print("="*80)
+    # Buffer this test's trace and flush it atomically, so concurrently
+    # running tests don't interleave their output
+    out = io.StringIO()
+    print("\n" + "="*80, file=out)
+    print("TEST 3: Billing Query - Should route to Final Agent", file=out)
+    print("="*80, file=out)
     
-    workflow = await setup_workflow()
     query = "What is my current bill balance?"
     
-    print(f"\n📝 Query: {query}")
-    print(f"\n🔄 Running workflow...\n")
+    print(f"\n📝 Query: {query}", file=out)
+    print(f"\n🔄 Running workflow...\n", file=out)
     
     try:
         events = await workflow.run(query)
         
         # Print agent execution trace
-        for event in events:
-            if isinstance(event, AgentRunEvent):
-                print(f"  → {event.executor_id}: {event.data}")
+        for event in _events_by_type(events).get(AgentRunEvent, ()):
+            print(f"  → {event.executor_id}: {event.data}", file=out)
         
-        print(f"\n✅ Final State: {events.get_final_state()}")
+        print(f"\n✅ Final State: {events.get_final_state()}", file=out)
         outputs = events.get_outputs()
         if outputs:
-            print(f"📊 Outputs: {outputs}")
+            print(f"📊 Outputs: {outputs}", file=out)
             
     except Exception as e:
-        print(f"❌ Error: {str(e)}")
+        print(f"❌ Error: {str(e)}", file=out)
+    finally:
+        print(out.getvalue(), end="")
 
 
-async def test_ticket_query():
+async def test_ticket_query(workflow):
     """Test ticket query - should go through database pipeline"""
-    print("\n" + "="*80)
-    print("TEST 4: Ticket Query - Should route to Database Pipeline")
-    print("="*80)
+    # Buffer this test's trace and flush it atomically, so concurrently
+    # running tests don't interleave their output
+    out = io.StringIO()
+    print("\n" + "="*80, file=out)
+    print("TEST 4: Ticket Query - Should route to Database Pipeline", file=out)
+    print("="*80, file=out)
     
-    workflow = await setup_workflow()
     query = "Show me all open support tickets for customer ID 12345"
     
-    print(f"\n📝 Query: {query}")
-    print(f"\n🔄 Running workflow...\n")
+    print(f"\n📝 Query: {query}", file=out)
+    print(f"\n🔄 Running workflow...\n", file=out)
     
     try:
         events = await workflow.run(query)
         
         # Print agent execution trace
-        for event in events:
-            if isinstance(event, AgentRunEvent):
-                print(f"  → {event.executor_id}: {event.data}")
+        for event in _events_by_type(events).get(AgentRunEvent, ()):
+            print(f"  → {event.executor_id}: {event.data}", file=out)
         
-        print(f"\n✅ Final State: {events.get_final_state()}")
+        print(f"\n✅ Final State: {events.get_final_state()}", file=out)
         outputs = events.get_outputs()
         if outputs:
-            print(f"📊 Outputs: {outputs}")
+            print(f"📊 Outputs: {outputs}", file=out)
             
     except Exception as e:
-        print(f"❌ Error: {str(e)}")
+        print(f"❌ Error: {str(e)}", file=out)
+    finally:
+        print(out.getvalue(), end="")
 
 
-async def test_complex_query():
+async def test_complex_query(workflow):
     """Test complex query - should route to Live Support"""
-    print("\n" + "="*80)
-    print("TEST 5: Complex Query - Should route to Final Agent")
-    print("="*80)
+    # Buffer this test's trace and flush it atomically, so concurrently
+    # running tests don't interleave their output
+    out = io.StringIO()
+    print("\n" + "="*80, file=out)
+    print("TEST 5: Complex Query - Should route to Final Agent", file=out)
+    print("="*80, file=out)
     
-    workflow = await setup_workflow()
     query = "I need help with a complex custom integration scenario"
     
-    print(f"\n📝 Query: {query}")
-    print(f"\n🔄 Running workflow...\n")
+    print(f"\n📝 Query: {query}", file=out)
+    print(f"\n🔄 Running workflow...\n", file=out)
     
     try:
         events = await workflow.run(query)
         
         # Print agent execution trace
-        for event in events:
-            if isinstance(event, AgentRunEvent):
-                print(f"  → {event.executor_id}: {event.data}")
+        for event in _events_by_type(events).get(AgentRunEvent, ()):
+            print(f"  → {event.executor_id}: {event.data}", file=out)
         
-        print(f"\n✅ Final State: {events.get_final_state()}")
+        print(f"\n✅ Final State: {events.get_final_state()}", file=out)
         outputs = events.get_outputs()
         if outputs:
-            print(f"📊 Outputs: {outputs}")
+            print(f"📊 Outputs: {outputs}", file=out)
             
     except Exception as e:
-        print(f"❌ Error: {str(e)}")
+        print(f"❌ Error: {str(e)}", file=out)
+    finally:
+        print(out.getvalue(), end="")
 
 
 async def print_workflow_structure():
@@ -203,12 +230,19 @@ async def main():
     # Print workflow structure
     await print_workflow_structure()
     
-    # Run tests
-    await test_order_query()
-    await test_fraud_query()
-    await test_billing_query()
-    await test_ticket_query()
-    await test_complex_query()
+    # Build the workflow once; agent/client construction dominates startup,
+    # so every test shares the same instance
+    workflow = await setup_workflow()
+    
+    # Run tests concurrently: they are independent and IO-bound on agent
+    # calls, so total time is the slowest test rather than the sum
+    await asyncio.gather(
+        test_order_query(workflow),
+        test_fraud_query(workflow),
+        test_billing_query(workflow),
+        test_ticket_query(workflow),
+        test_complex_query(workflow),
+    )
     
     # Summary
     print("\n" + "="*80)